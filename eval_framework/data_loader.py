@@ -2,6 +2,8 @@ import pandas as pd
 import numpy as np
 from sklearn.model_selection import train_test_split
 import warnings
+import hashlib
+import os
 
 warnings.filterwarnings('ignore')
 
@@ -9,31 +11,66 @@ def load_data(sample_size=None):
     """Load MovieLens dataset"""
     print("Loading data...")
     
-    # Load ratings
-    ratings = pd.read_csv(r'..\\data\ml-latest-small\ml-latest-small\ratings.csv', header=0)
+    # Load ratings (multi-threaded Arrow reader, only the typed columns we use)
+    ratings = pd.read_csv(
+        r'..\\data\ml-latest-small\ml-latest-small\ratings.csv', header=0, engine='pyarrow',
+        usecols=['userId', 'movieId', 'rating'],
+        dtype={'userId': 'int32', 'movieId': 'int32', 'rating': 'float32'}
+    )
     
     # Load movies
-    movies = pd.read_csv(r'..\\data\ml-latest-small\ml-latest-small\movies.csv', header=0)
+    movies = pd.read_csv(
+        r'..\\data\ml-latest-small\ml-latest-small\movies.csv', header=0, engine='pyarrow',
+        usecols=['movieId', 'title', 'genres'],
+        dtype={'movieId': 'int32', 'title': 'string', 'genres': 'string'}
+    )
     
     # Convert genres to list format
     movies['genres'] = movies['genres'].str.split('|')
-    movies = movies[['movieId', 'title', 'genres']]
     
     if sample_size:
         # Sample users
+        rng = np.random.default_rng(42)
         unique_users = ratings['userId'].unique()
-        sampled_users = np.random.choice(unique_users, size=sample_size, replace=False)
-        ratings = ratings[ratings['userId'].isin(sampled_users)]
-        movies = movies[movies['movieId'].isin(ratings['movieId'].unique())]
+        sampled_users = rng.choice(unique_users, size=sample_size, replace=False)
+        ratings = ratings.set_index('userId').loc[sampled_users].reset_index()
+        
+        # Keep only movies rated by the sampled users
+        movies = movies.set_index('movieId')
+        kept_movies = movies.index.intersection(ratings['movieId'].unique())
+        movies = movies.loc[kept_movies].reset_index()
     
     print(f"Loaded {len(ratings)} ratings and {len(movies)} movies")
     return ratings, movies
 
-def split_data(ratings, test_size=0.2, random_state=42):
-    """Split data into train and test sets"""
+def split_data(ratings, test_size=0.2, random_state=42, cache_dir=None):
+    """
+    Split data into train and test sets.
+    If cache_dir is given and ratings is a DataFrame, the split is cached there as parquet,
+    keyed by a hash of the frame's values, index, column names and dtypes.
+    """
     print("\\nSplitting data...")
-    train_ratings, test_ratings = train_test_split(
-        ratings, test_size=test_size, random_state=random_state
-    )
+    if cache_dir is None or not isinstance(ratings, pd.DataFrame):
+        train_ratings, test_ratings = train_test_split(
+            ratings, test_size=test_size, random_state=random_state
+        )
+        print(f"Training set size: {len(train_ratings)}, Test set size: {len(test_ratings)}")
+        return train_ratings, test_ratings
+    
+    digest = hashlib.md5(pd.util.hash_pandas_object(ratings, index=True).values)
+    digest.update(repr([(str(col), str(dtype)) for col, dtype in ratings.dtypes.items()]).encode())
+    key = digest.hexdigest()[:12]
+    cache = os.path.join(cache_dir, f'split_{key}_{test_size}_{random_state}')
+    
+    if os.path.exists(cache + '_train.parquet') and os.path.exists(cache + '_test.parquet'):
+        train_ratings = pd.read_parquet(cache + '_train.parquet')
+        test_ratings = pd.read_parquet(cache + '_test.parquet')
+    else:
+        train_ratings, test_ratings = train_test_split(
+            ratings, test_size=test_size, random_state=random_state
+        )
+        os.makedirs(cache_dir, exist_ok=True)
+        train_ratings.to_parquet(cache + '_train.parquet')
+        test_ratings.to_parquet(cache + '_test.parquet')
     print(f"Training set size: {len(train_ratings)}, Test set size: {len(test_ratings)}")
-    return train_ratings, test_ratings
\ No newline at end of file
+    return train_ratings, test_ratings
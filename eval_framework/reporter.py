@@ -1,17 +1,36 @@
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
-import seaborn as sns
 import time
-from sklearn.metrics import mean_squared_error, mean_absolute_error
+from scipy.stats import gaussian_kde
 from tqdm import tqdm
+try:
+    import numexpr as ne
+except ImportError:
+    ne = None
+
+# numexpr's dispatch overhead only pays off on larger arrays
+_NUMEXPR_MIN_SIZE = 10_000
+
+# Rows per predict_batch call when reporting evaluation progress
+_EVAL_CHUNK_SIZE = 100_000
+
+def _kde_curve(values, grid, max_points=10000):
+    """Evaluate a Gaussian KDE of values on grid, fitted on at most max_points samples."""
+    values = np.asarray(values, dtype=np.float64)
+    if len(values) > max_points:
+        values = np.random.default_rng(0).choice(values, size=max_points, replace=False)
+    try:
+        return gaussian_kde(values)(grid)
+    except np.linalg.LinAlgError:
+        # Degenerate (e.g. constant) input has no density estimate
+        return None
 
 class BaseRecommenderReporter:
     """
     Base class for visualizing and reporting results of recommender system models.
     Usage:
         reporter = BaseRecommenderReporter()
-        results = reporter.evaluate_predictions(model, test_ratings)
+        results = reporter.evaluate_model(model, test_ratings)
         reporter.plot_all(results)
         reporter.print_stats(results)
     """
@@ -27,24 +46,41 @@ class BaseRecommenderReporter:
         self.model = model
         
         print("\nEvaluating predictions...")
-        predictions = []
-        actuals = []
         start_time = time.time()
-        
-        for _, row in tqdm(test_ratings.iterrows(), total=len(test_ratings), desc="Evaluating ratings"):
-            pred = model.predict(row['userId'], row['movieId'])
-            predictions.append(pred)
-            actuals.append(row['rating'])
+
+        actuals = test_ratings['rating'].to_numpy(np.float64, copy=True)
+        if hasattr(model, 'predict_batch'):
+            # Vectorized path: one call per chunk of the test set, progress per chunk
+            n_chunks = max(1, len(test_ratings) // _EVAL_CHUNK_SIZE)
+            user_chunks = np.array_split(test_ratings['userId'].to_numpy(), n_chunks)
+            movie_chunks = np.array_split(test_ratings['movieId'].to_numpy(), n_chunks)
+            predictions = np.concatenate([
+                model.predict_batch(u, m)
+                for u, m in tqdm(zip(user_chunks, movie_chunks), total=n_chunks, desc="Evaluating ratings")
+            ])
+        else:
+            predictions = np.empty(len(test_ratings))
+            for k, row in enumerate(test_ratings.itertuples(index=False)):
+                predictions[k] = model.predict(row.userId, row.movieId)
 
         end_time = time.time()
         
-        return self._calculate_metrics(predictions, actuals, start_time-end_time)
+        return self._calculate_metrics(predictions, actuals, end_time-start_time)
 
     def _calculate_metrics(self, predictions, actuals, inference_times=None):
+        predictions = np.asarray(predictions, dtype=np.float64)
+        actuals = np.asarray(actuals, dtype=np.float64)
+        
         # Calculate metrics
-        mse = mean_squared_error(actuals, predictions)
-        rmse = np.sqrt(mse)
-        mae = mean_absolute_error(actuals, predictions)
+        if ne is not None and predictions.size > _NUMEXPR_MIN_SIZE:
+            err = ne.evaluate('predictions - actuals')
+            mse = float(ne.evaluate('sum(err * err)')) / err.size
+            mae = float(ne.evaluate('sum(abs(err))')) / err.size
+        else:
+            err = predictions - actuals
+            mse = float(np.dot(err, err) / err.size)
+            mae = float(np.abs(err).mean())
+        rmse = float(np.sqrt(mse))
         self.results = {
             'mse': mse,
             'rmse': rmse,
@@ -64,6 +100,8 @@ class BaseRecommenderReporter:
     
     def plot_all(self, save_path='recommender_results.png'):
         """Plot evaluation results (universal for all models)."""
+        import matplotlib.pyplot as plt
+
         print("\nGenerating universal plots...")
         
         # Determine number of plots based on available data
@@ -75,7 +113,10 @@ class BaseRecommenderReporter:
 
         # Plot 1: Actual vs Predicted
         ax1 = fig.add_subplot(gs[0, 0])
-        ax1.scatter(self.results['actuals'], self.results['predictions'], alpha=0.5)
+        # Scatter a fixed random subset so rendering cost does not grow with the test set
+        n = len(self.results['actuals'])
+        idx = np.random.default_rng(0).choice(n, size=min(n, 5000), replace=False)
+        ax1.scatter(self.results['actuals'][idx], self.results['predictions'][idx], alpha=0.5, s=4, rasterized=True)
         ax1.plot([0, 5], [0, 5], 'r--')
         ax1.set_xlabel('Actual Ratings')
         ax1.set_ylabel('Predicted Ratings')
@@ -83,18 +124,28 @@ class BaseRecommenderReporter:
 
         # Plot 2: Error Distribution
         ax2 = fig.add_subplot(gs[0, 1])
-        errors = np.array(self.results['predictions']) - np.array(self.results['actuals'])
-        sns.histplot(errors, kde=True, ax=ax2)
+        errors = self.results['predictions'] - self.results['actuals']
+        error_grid = np.linspace(errors.min(), errors.max(), 200)
+        kde_e = _kde_curve(errors, error_grid)
+        bars = ax2.hist(errors, bins=50, density=True, alpha=0.5, rasterized=True)[2]
+        if kde_e is not None:
+            ax2.plot(error_grid, kde_e, color=bars[0].get_facecolor()[:3])
         ax2.set_xlabel('Prediction Error')
-        ax2.set_ylabel('Count')
+        ax2.set_ylabel('Density')
         ax2.set_title('Distribution of Prediction Errors')
 
         # Plot 3: Rating Distribution
         ax3 = fig.add_subplot(gs[0, 2])
-        sns.histplot(self.results['actuals'], kde=True, ax=ax3, label='Actual')
-        sns.histplot(self.results['predictions'], kde=True, ax=ax3, label='Predicted')
+        rating_grid = np.linspace(
+            min(0.5, self.results['predictions'].min()), max(5.5, self.results['predictions'].max()), 200
+        )
+        for values, label in [(self.results['actuals'], 'Actual'), (self.results['predictions'], 'Predicted')]:
+            bars = ax3.hist(values, bins=50, density=True, alpha=0.5, label=label, rasterized=True)[2]
+            kde = _kde_curve(values, rating_grid)
+            if kde is not None:
+                ax3.plot(rating_grid, kde, color=bars[0].get_facecolor()[:3])
         ax3.set_xlabel('Rating')
-        ax3.set_ylabel('Count')
+        ax3.set_ylabel('Density')
         ax3.set_title('Distribution of Ratings')
         ax3.legend()
 
@@ -132,12 +183,16 @@ class HBMRecommenderReporter(BaseRecommenderReporter):
     def evaluate_model(self, model, test_ratings):
         super().evaluate_model(model, test_ratings)
         self.trace = model.trace
-        self.mu_mean = self.trace.posterior['mu'].mean(dim=("chain", "draw")).values
-        self.alpha_mean = self.trace.posterior['alpha'].mean(dim=("chain", "draw")).values
-        self.beta_mean = self.trace.posterior['beta'].mean(dim=("chain", "draw")).values
+        # Reuse the posterior means the model already reduced at fit time
+        self.mu_mean = model._mu
+        self.alpha_mean = model._alpha
+        self.beta_mean = model._beta
 
     def plot_all(self, save_path='hbm_results.png'):
         """Plot universal and HBM-specific results."""
+        import matplotlib.pyplot as plt
+        import seaborn as sns
+
         # First plot universal
         super().plot_all(save_path=save_path)
         # Then add HBM-specific parameter plot
@@ -164,7 +219,7 @@ class HBMRecommenderReporter(BaseRecommenderReporter):
         
         if movies is not None:
             movie_bias = pd.DataFrame({
-                'movieId': list(self.model.movie_map.keys()),
+                'movieId': self.model.movie_index,
                 'bias': self.beta_mean
             })
 
@@ -185,7 +240,7 @@ class MLNRecommenderReporter(BaseRecommenderReporter):
     def __init__(self):
         super().__init__()
 
-    def evaluate_model(self, model, test_ratings, batch_size=1000, n_jobs=-1):
+    def evaluate_model(self, model, test_ratings, batch_size=100, n_jobs=-1):
         self.model = model
         
         print("\nEvaluating predictions...")
@@ -193,7 +248,7 @@ class MLNRecommenderReporter(BaseRecommenderReporter):
         predictions = model.predict(test_ratings, batch_size=batch_size, n_jobs=n_jobs)
         end_time = time.time()
         
-        return self._calculate_metrics(predictions['rating'], test_ratings['rating'], start_time-end_time)
+        return self._calculate_metrics(predictions['rating'], test_ratings['rating'], end_time-start_time)
         
 class PMFRecommenderReporter(BaseRecommenderReporter):
     """
@@ -211,19 +266,21 @@ class PMFRecommenderReporter(BaseRecommenderReporter):
         
         print("\nEvaluating predictions...")
         start_time = time.time()
-        predictions = pd.DataFrame(columns=['userId', 'movieId', 'rating'])
+        predictions = np.empty(len(test_ratings))
         pred_cache = {}
-        for i, row in tqdm(test_ratings.iterrows(), total=len(test_ratings), desc="Evaluating ratings"):
-            if row['userId'] not in pred_cache:
-                pred_cache[row['userId']] = model.predict(row['userId'])
-            predictions.loc[i] = {
-                'userId': row['userId'], 'movieId': row['movieId'], 'rating': pred_cache[row['userId']][int(row['movieId'])]}
+        for k, row in enumerate(test_ratings.itertuples(index=False)):
+            u = row.userId
+            if u not in pred_cache:
+                pred_cache[u] = model.predict(u)
+            predictions[k] = pred_cache[u][int(row.movieId)]
         end_time = time.time()
         
-        return self._calculate_metrics(predictions['rating'], test_ratings['rating'], start_time-end_time)
+        return self._calculate_metrics(predictions, test_ratings['rating'].to_numpy(), end_time-start_time)
         
     def plot_all(self, save_path='pmf_results.png'):
         """Plot universal and PMF-specific results."""
+        import matplotlib.pyplot as plt
+
         # First plot universal
         super().plot_all(save_path=save_path)
 
@@ -1,22 +1,36 @@
 import pandas as pd
 import numpy as np
 import pymc as pm
+import pytensor
 import pytensor.tensor as pt
 from sklearn.preprocessing import MultiLabelBinarizer
 from scipy import sparse
 #import torch
-from tqdm import tqdm
 import warnings
 import pickle
 import json
 import os
+import importlib.util
 from pathlib import Path
 import arviz as az
+from pymc.variational.callbacks import CheckParametersConvergence
+try:
+    import numba
+except ImportError:
+    numba = None
 warnings.filterwarnings('ignore')
 
+if numba is not None:
+    @numba.njit(parallel=True, fastmath=True, cache=True)
+    def _hbm_predict_kernel(u_idx, m_idx, alpha, beta, mu, out):
+        """Fused gather-add: out[i] = mu + alpha[u_idx[i]] + beta[m_idx[i]]"""
+        for i in numba.prange(u_idx.shape[0]):
+            out[i] = mu + alpha[u_idx[i]] + beta[m_idx[i]]
+
 class HierarchicalBayesianRecommender:
     def __init__(self, chains=4, target_accept=0.9, draws=1000, tune=1000,
-                 sigma_alpha=10, sigma_beta=10, sigma=1, mu_mean=3.0, mu_sigma=1):
+                 sigma_alpha=10, sigma_beta=10, sigma=1, mu_mean=3.0, mu_sigma=1,
+                 inference='mcmc', n_iter=50000, sampler='nutpie', keep_trace=False):
         """
         Hierarchical Bayesian Model for Movie Recommendations
         
@@ -40,19 +54,43 @@ class HierarchicalBayesianRecommender:
             Prior mean for global rating mean
         mu_sigma : float, default=1
             Prior scale for global rating mean
+        inference : str, default='mcmc'
+            'mcmc' to sample with NUTS, or 'advi' for mean-field variational
+            inference that stops early once the parameters converge
+        n_iter : int, default=50000
+            Maximum number of ADVI iterations (only used when inference='advi')
+        sampler : str, default='nutpie'
+            NUTS backend: 'nutpie' (Numba-compiled logp, Rust sampler), 'numpyro'
+            (JAX/XLA, chains run in parallel) or 'pymc'. Falls back to 'pymc' when
+            the requested backend is not installed
+        keep_trace : bool, default=False
+            Keep the full posterior trace after fitting (needed for convergence
+            diagnostics). When False only the posterior means are kept and saved
         """
+        if inference not in ('mcmc', 'advi'):
+            raise ValueError("inference must be 'mcmc' or 'advi'")
+        if sampler not in ('nutpie', 'numpyro', 'pymc'):
+            raise ValueError("sampler must be 'nutpie', 'numpyro' or 'pymc'")
+        
         # Data attributes (will be initialized during fit)
         self.ratings_df = None
         self.movies_df = None
         self.model = None
         self.trace = None
         self._posterior_means = None
+        self._mu = None
+        self._alpha = None
+        self._beta = None
         
         # Training hyperparameters
         self.chains = chains
         self.target_accept = target_accept
         self.draws = draws
         self.tune = tune
+        self.inference = inference
+        self.n_iter = n_iter
+        self.sampler = sampler
+        self.keep_trace = keep_trace
         
         # Model hyperparameters
         self.sigma_alpha = sigma_alpha
@@ -66,50 +104,94 @@ class HierarchicalBayesianRecommender:
         self.movie_map = None
         self.user_reverse_map = None
         self.movie_reverse_map = None
+        self.user_index = None
+        self.movie_index = None
         self.num_users = None
         self.num_movies = None
-        self.rating_matrix = None
+        self._rating_matrix = None
+        self._rating_mean = None
+        self._rating_matrix_csc = None
+        self._model_key = None
         
     def _preprocess(self):
         """Preprocess data and create mappings"""
+        # Factorize user and movie IDs into integer codes
+        u_cat = pd.Categorical(self.ratings_df['userId'])
+        movie_ids = self.movies_df['movieId'].unique()
+        known = self.ratings_df['movieId'].isin(movie_ids).to_numpy()
+        if not known.all():
+            # Unknown movies would get code -1 and silently index the last movie's bias
+            missing = self.ratings_df['movieId'][~known].unique()
+            raise ValueError(f"ratings_df contains movieIds not in movies_df: {missing[:10].tolist()}")
+        m_cat = pd.Categorical(self.ratings_df['movieId'], categories=movie_ids)
+        
+        self._set_id_maps(u_cat.categories, m_cat.categories)
+        
+        # Update indices (int32 codes and float32 ratings halve the observed data width)
+        self.ratings_df['uidx'] = u_cat.codes.astype(np.int32)
+        self.ratings_df['midx'] = m_cat.codes.astype(np.int32)
+        self.ratings_df['rating'] = self.ratings_df['rating'].astype(np.float32)
+        
+        # Sparse rating matrices are built lazily on first access
+        self._rating_matrix = None
+        self._rating_matrix_csc = None
+        
+        # Empirical global mean, subtracted from the observed ratings before fitting
+        self._rating_mean = float(self.ratings_df['rating'].to_numpy().mean(dtype=np.float64))
+    
+    def _set_id_maps(self, user_ids, movie_ids):
+        """Build ID <-> index mappings from the ordered user and movie IDs"""
+        # Hashed ID indexes for vectorized lookups
+        self.user_index = pd.Index(user_ids)
+        self.movie_index = pd.Index(movie_ids)
+        
         # Create user and movie mappings
-        self.user_map = {uid: i for i, uid in enumerate(self.ratings_df['userId'].unique())}
-        self.movie_map = {mid: i for i, mid in enumerate(self.movies_df['movieId'].unique())}
+        self.user_map = {uid: i for i, uid in enumerate(self.user_index)}
+        self.movie_map = {mid: i for i, mid in enumerate(self.movie_index)}
         
         # Create reverse mappings
-        self.user_reverse_map = {v: k for k, v in self.user_map.items()}
-        self.movie_reverse_map = {v: k for k, v in self.movie_map.items()}
-        
-        # Update indices
-        self.ratings_df['uidx'] = self.ratings_df['userId'].map(self.user_map)
-        self.ratings_df['midx'] = self.ratings_df['movieId'].map(self.movie_map)
+        self.user_reverse_map = dict(enumerate(self.user_index))
+        self.movie_reverse_map = dict(enumerate(self.movie_index))
         
         # Calculate dimensions
-        self.num_users = len(self.user_map)
-        self.num_movies = len(self.movie_map)
-        
-        # Create sparse rating matrix
-        self.rating_matrix = sparse.csr_matrix(
-            (self.ratings_df['rating'].values,
-             (self.ratings_df['uidx'].values, self.ratings_df['midx'].values)),
-            shape=(self.num_users, self.num_movies)
-        )
+        self.num_users = len(self.user_index)
+        self.num_movies = len(self.movie_index)
+    
+    @property
+    def rating_matrix(self):
+        """Sparse (num_users x num_movies) CSR matrix of training ratings"""
+        if self._rating_matrix is None:
+            self._rating_matrix = sparse.csr_matrix(
+                (self.ratings_df['rating'].to_numpy(np.float32),
+                 (self.ratings_df['uidx'].to_numpy(), self.ratings_df['midx'].to_numpy())),
+                shape=(self.num_users, self.num_movies)
+            )
+        return self._rating_matrix
+    
+    @property
+    def rating_matrix_csc(self):
+        """CSC copy of rating_matrix for per-movie column access"""
+        if self._rating_matrix_csc is None:
+            self._rating_matrix_csc = self.rating_matrix.tocsc()
+        return self._rating_matrix_csc
     
     def _get_user_ratings(self, user_id):
         """Get all ratings for a specific user"""
         if user_id not in self.user_map:
             return pd.DataFrame()
+        mat = self.rating_matrix
         u_idx = self.user_map[user_id]
-        user_ratings = self.ratings_df[self.ratings_df['uidx'] == u_idx]
-        return user_ratings
+        start, end = mat.indptr[u_idx], mat.indptr[u_idx + 1]
+        return pd.DataFrame({'midx': mat.indices[start:end], 'rating': mat.data[start:end]})
     
     def _get_movie_ratings(self, movie_id):
         """Get all ratings for a specific movie"""
         if movie_id not in self.movie_map:
             return pd.DataFrame()
+        mat = self.rating_matrix_csc
         m_idx = self.movie_map[movie_id]
-        movie_ratings = self.ratings_df[self.ratings_df['midx'] == m_idx]
-        return movie_ratings
+        start, end = mat.indptr[m_idx], mat.indptr[m_idx + 1]
+        return pd.DataFrame({'uidx': mat.indices[start:end], 'rating': mat.data[start:end]})
     
     def fit(self, ratings_df, movies_df):
         """
@@ -122,49 +204,148 @@ class HierarchicalBayesianRecommender:
         movies_df : DataFrame
             DataFrame with columns ['movieId', 'genres']
         """
-        # Store and preprocess data
-        self.ratings_df = ratings_df.copy()
-        self.movies_df = movies_df.copy()
+        # Store and preprocess data (movies_df is only read, so it is not copied)
+        self.ratings_df = ratings_df[['userId', 'movieId', 'rating']].copy()
+        self.movies_df = movies_df
         self._preprocess()
         
-        print(f"Fitting model with MCMC...")
-        print(f"Configuration: chains={self.chains}, draws={self.draws}, tune={self.tune}, target_accept={self.target_accept}")
+        if self.inference == 'advi':
+            print(f"Fitting model with ADVI...")
+            print(f"Configuration: n_iter={self.n_iter}, draws={self.draws}")
+        else:
+            print(f"Fitting model with MCMC...")
+            print(f"Configuration: chains={self.chains}, draws={self.draws}, tune={self.tune}, target_accept={self.target_accept}, sampler={self.sampler}")
+        
+        uidx = self.ratings_df['uidx'].to_numpy(np.int32)
+        midx = self.ratings_df['midx'].to_numpy(np.int32)
+        observed = self.ratings_df['rating'].to_numpy(np.float32) - np.float32(self._rating_mean)
+        # Prior mean of mu on the centered scale
+        mu_offset = np.float32(self.mu_mean - self._rating_mean)
+        
+        # Build and sample a float32 graph; float64 precision is not needed for half-star ratings
+        with pytensor.config.change_flags(floatX='float32'):
+            if self._model_key == self._model_signature():
+                # Same parameter shapes and priors as the last fit: swap in the new
+                # data and reuse the model graph instead of rebuilding it
+                with self.model:
+                    pm.set_data({'uidx': uidx, 'midx': midx, 'observed': observed, 'mu_offset': mu_offset})
+            else:
+                self._build_model(uidx, midx, observed, mu_offset)
+        
+        with pytensor.config.change_flags(floatX='float32'), self.model:
+            if self.inference == 'advi':
+                # Use ADVI, stopping as soon as the parameters stop moving
+                approx = pm.fit(
+                    n=self.n_iter,
+                    method='advi',
+                    progressbar=True,
+                    callbacks=[CheckParametersConvergence(diff='absolute', tolerance=1e-3)]
+                )
+                self.trace = approx.sample(self.draws)
+            else:
+                # Use MCMC (NUTS) for inference, one core per chain where available
+                nuts_sampler = self._resolve_sampler()
+                cores = max(1, min(self.chains, os.cpu_count() or 1))
+                nuts_sampler_kwargs = {}
+                compile_kwargs = None
+                if nuts_sampler == 'nutpie':
+                    nuts_sampler_kwargs['cores'] = cores
+                elif nuts_sampler == 'numpyro':
+                    # Run each chain on its own XLA host device; with fewer cores than
+                    # chains (or on Windows) run them one after another instead
+                    parallel = cores >= self.chains and os.name != 'nt'
+                    nuts_sampler_kwargs['chain_method'] = 'parallel' if parallel else 'sequential'
+                elif numba is not None:
+                    # Compile logp/dlogp once with Numba instead of the default C backend
+                    compile_kwargs = {'mode': 'NUMBA'}
+                self.trace = pm.sample(
+                    draws=self.draws,
+                    tune=self.tune,
+                    chains=self.chains,
+                    cores=cores,
+                    target_accept=self.target_accept,
+                    progressbar=True,
+                    return_inferencedata=True,
+                    nuts_sampler=nuts_sampler,
+                    nuts_sampler_kwargs=nuts_sampler_kwargs,
+                    compile_kwargs=compile_kwargs
+                )
+        trace = self.trace
+        
+        alpha_mean = trace.posterior['alpha'].mean(dim=("chain", "draw")).values.astype(np.float32)
+        beta_mean = trace.posterior['beta'].mean(dim=("chain", "draw")).values.astype(np.float32)
+        # Averaging the per-draw conditional mean of mu gives its marginal posterior mean
+        mu_posterior = self._rating_mean + float(trace.posterior['mu_centered'].mean())
+        self._posterior_means = {
+                'mu': mu_posterior,
+                'alpha': alpha_mean,
+                'beta': beta_mean
+            }
+        self._cache_posterior_means()
+        
+        if not self.keep_trace:
+            # Only the posterior means are needed for prediction
+            self.trace = None
         
+        print("Model fitting completed.")
+    
+    def _build_model(self, uidx, midx, observed, mu_offset):
+        """Build the PyMC model, with the observed data held in shared pm.Data containers"""
         with pm.Model() as self.model:
+            uidx = pm.Data('uidx', uidx)
+            midx = pm.Data('midx', midx)
+            observed = pm.Data('observed', observed)
+            mu_offset = pm.Data('mu_offset', mu_offset)
+            
             # Level 3: Hyperpriors
             sigma_alpha = pm.HalfNormal('sigma_alpha', sigma=self.sigma_alpha)
             sigma_beta = pm.HalfNormal('sigma_beta', sigma=self.sigma_beta)
             sigma = pm.HalfNormal('sigma', sigma=self.sigma)
             
-            # Level 2: Population parameters
-            mu = pm.Normal('mu', mu=self.mu_mean, sigma=self.mu_sigma)  # Global mean rating
-            alpha = pm.Normal('alpha', mu=0, sigma=sigma_alpha, shape=self.num_users)  # User bias
-            beta = pm.Normal('beta', mu=0, sigma=sigma_beta, shape=self.num_movies)  # Movie bias
+            # Level 2: Population parameters (non-centered; the global mean is
+            # integrated out of the likelihood below)
+            alpha_raw = pm.Normal('alpha_raw', mu=0, sigma=1, shape=self.num_users)
+            beta_raw = pm.Normal('beta_raw', mu=0, sigma=1, shape=self.num_movies)
+            alpha = pm.Deterministic('alpha', alpha_raw * sigma_alpha)  # User bias
+            beta = pm.Deterministic('beta', beta_raw * sigma_beta)  # Movie bias
             
-            # Level 1: Likelihood
-            pm.Normal('ratings', 
-                     mu=mu + alpha[self.ratings_df['uidx']] + beta[self.ratings_df['midx']],
-                     sigma=sigma,
-                     observed=self.ratings_df['rating'].values)
+            # Level 1: Likelihood with mu ~ Normal(mu_mean, mu_sigma) marginalized out.
+            # The residuals e = r - mu_mean - alpha_u - beta_m are jointly
+            # MvNormal(0, sigma^2 I + mu_sigma^2 11^T); by Sherman-Morrison its
+            # log-density only needs sum(e) and sum(e^2), so it stays O(N)
+            resid = observed - mu_offset - alpha[uidx] - beta[midx]
+            n = pt.cast(resid.shape[0], resid.dtype)
+            resid_sum = pt.sum(resid)
+            mu_var = self.mu_sigma ** 2
+            total_var = sigma ** 2 + n * mu_var
+            pm.Potential('ratings',
+                         -0.5 * n * np.log(2 * np.pi) - (n - 1) * pt.log(sigma) - 0.5 * pt.log(total_var)
+                         - 0.5 * (pt.sum(resid ** 2) - mu_var * resid_sum ** 2 / total_var) / sigma ** 2)
             
-            # Use MCMC (NUTS) for inference
-            self.trace = pm.sample(
-                draws=self.draws,
-                tune=self.tune,
-                chains=self.chains,
-                target_accept=self.target_accept,
-                progressbar=True,
-                return_inferencedata=True
-            )
-        trace = self.trace
-        
-        self._posterior_means = {
-                'mu': trace.posterior['mu'].mean(dim=("chain", "draw")).values,
-                'alpha': trace.posterior['alpha'].mean(dim=("chain", "draw")).values,
-                'beta': trace.posterior['beta'].mean(dim=("chain", "draw")).values
-            }
-        
-        print("Model fitting completed.")
+            # Posterior mean of the centered mu given the biases and sigma (conjugate update)
+            pm.Deterministic('mu_centered', mu_offset + mu_var * resid_sum / total_var)
+        self._model_key = self._model_signature()
+    
+    def _model_signature(self):
+        """Everything baked into the model graph besides the observed data"""
+        return (self.num_users, self.num_movies, self.sigma_alpha, self.sigma_beta, self.sigma, self.mu_sigma)
+    
+    def _resolve_sampler(self):
+        """Return the NUTS backend to use, falling back to PyMC if the requested one is not installed"""
+        required = {'nutpie': ['nutpie'], 'numpyro': ['jax', 'numpyro']}.get(self.sampler, [])
+        if any(importlib.util.find_spec(pkg) is None for pkg in required):
+            print(f"{self.sampler} is not installed; falling back to the PyMC NUTS sampler")
+            return 'pymc'
+        if self.sampler == 'numpyro':
+            # Expose one CPU device per chain; only effective before JAX is first imported
+            os.environ.setdefault('XLA_FLAGS', f'--xla_force_host_platform_device_count={self.chains}')
+        return self.sampler
+    
+    def _cache_posterior_means(self):
+        """Expose posterior means as plain float32 attributes for the prediction hot path"""
+        self._mu = float(self._posterior_means['mu'])
+        self._alpha = np.ascontiguousarray(self._posterior_means['alpha'], dtype=np.float32)
+        self._beta = np.ascontiguousarray(self._posterior_means['beta'], dtype=np.float32)
     
     def predict(self, user_id, movie_id):
         """
@@ -187,24 +368,45 @@ class HierarchicalBayesianRecommender:
             
         if user_id not in self.user_map or movie_id not in self.movie_map:
             raise ValueError("user_id or movie_id not in training data")
-        
-        assert hasattr(self, '_posterior_means'), "Posterior means not calculated"
             
         # Get indices
         u_idx = self.user_map[user_id]
         m_idx = self.movie_map[movie_id]
         
-        # Get posterior means
-        mu_mean = self._posterior_means['mu']
-        alpha_mean = self._posterior_means['alpha']
-        beta_mean = self._posterior_means['beta']
-        
-        # Calculate prediction using posterior means
-        pred = mu_mean + alpha_mean[u_idx] + beta_mean[m_idx]
-        
-        return float(pred)
+        # Calculate prediction using cached posterior means
+        return float(self._mu + self._alpha[u_idx] + self._beta[m_idx])
+
+    def predict_batch(self, user_ids, movie_ids):
+        """
+        Predict ratings for many user-movie pairs at once
+
+        Parameters:
+        -----------
+        user_ids : array-like
+            User IDs
+        movie_ids : array-like
+            Movie IDs, aligned with user_ids
+
+        Returns:
+        --------
+        ndarray
+            Predicted ratings
+        """
+        if not self.is_fitted:
+            raise ValueError("Model must be fitted before making predictions")
+
+        u_idx = self.user_index.get_indexer(np.asarray(user_ids))
+        m_idx = self.movie_index.get_indexer(np.asarray(movie_ids))
+        if (u_idx < 0).any() or (m_idx < 0).any():
+            raise ValueError("user_id or movie_id not in training data")
+
+        # Calculate predictions using posterior means
+        if numba is None:
+            return self._mu + self._alpha[u_idx] + self._beta[m_idx]
+        out = np.empty(len(u_idx), dtype=self._alpha.dtype)
+        _hbm_predict_kernel(u_idx, m_idx, self._alpha, self._beta, self._mu, out)
+        return out
 
-    
     def get_recommendations(self, user_id, n_recommendations=10, n_samples=100):
         """
         Get top-N movie recommendations for a user
@@ -228,26 +430,24 @@ class HierarchicalBayesianRecommender:
             
         if user_id not in self.user_map:
             raise ValueError("user_id not in training data")
-        
-        assert hasattr(self, '_posterior_means'), "Posterior means not calculated"
             
-        # Get user's rated movies
-        user_rated = set(self.ratings_df[self.ratings_df['userId'] == user_id]['movieId'])
-        all_movies = set(self.movie_map.keys())
-        unrated_movies = list(all_movies - user_rated)
-        
-        # Get predictions for unrated movies
-        predictions = []
-        for movie_id in tqdm(unrated_movies[:20], desc="Generating recommendations"):
-            try:
-                pred = self.predict(user_id, movie_id)
-                predictions.append((movie_id, pred))
-            except:
-                continue
-        
-        # Sort and return top-N
-        predictions.sort(key=lambda x: x[1], reverse=True)
-        return predictions[:n_recommendations]
+        u_idx = self.user_map[user_id]
+        
+        # Get user's rated movies as movie indices
+        mat = self.rating_matrix
+        rated_midx = mat.indices[mat.indptr[u_idx]:mat.indptr[u_idx + 1]]
+        
+        # Score every movie at once and exclude the ones already rated
+        scores = self._mu + self._alpha[u_idx] + self._beta
+        scores[rated_midx] = -np.inf
+        
+        # Select and sort top-N
+        n = min(n_recommendations, self.num_movies - len(rated_midx))
+        if n <= 0:
+            return []
+        top = np.argpartition(-scores, n - 1)[:n]
+        top = top[np.argsort(-scores[top])]
+        return list(zip(self.movie_index[top].tolist(), scores[top].tolist()))
     
     def save(self, filepath):
         """
@@ -266,9 +466,10 @@ class HierarchicalBayesianRecommender:
         # Create directory if it doesn't exist
         filepath.parent.mkdir(parents=True, exist_ok=True)
         
-        # Save trace using arviz
+        # Save trace using arviz (only kept when keep_trace=True)
         trace_path = str(filepath) + "_trace.nc"
-        self.trace.to_netcdf(trace_path)
+        if self.trace is not None:
+            self.trace.to_netcdf(trace_path)
         
         # Save model state (everything except trace and model)
         model_state = {
@@ -276,17 +477,15 @@ class HierarchicalBayesianRecommender:
             'target_accept': self.target_accept,
             'draws': self.draws,
             'tune': self.tune,
+            'inference': self.inference,
+            'n_iter': self.n_iter,
+            'sampler': self.sampler,
+            'keep_trace': self.keep_trace,
             'sigma_alpha': self.sigma_alpha,
             'sigma_beta': self.sigma_beta,
             'sigma': self.sigma,
             'mu_mean': self.mu_mean,
             'mu_sigma': self.mu_sigma,
-            'user_map': self.user_map,
-            'movie_map': self.movie_map,
-            'user_reverse_map': self.user_reverse_map,
-            'movie_reverse_map': self.movie_reverse_map,
-            'num_users': self.num_users,
-            'num_movies': self.num_movies,
             '_posterior_means': self._posterior_means
         }
         
@@ -294,19 +493,20 @@ class HierarchicalBayesianRecommender:
         with open(state_path, 'wb') as f:
             pickle.dump(model_state, f)
         
-        # Save data frames
-        data_path = str(filepath) + "_data.pkl"
-        data_dict = {
-            'ratings_df': self.ratings_df,
-            'movies_df': self.movies_df
-        }
-        with open(data_path, 'wb') as f:
-            pickle.dump(data_dict, f)
+        # Save the sparse rating matrix; the ratings DataFrame is not needed for inference
+        matrix_path = str(filepath) + "_matrix.npz"
+        sparse.save_npz(matrix_path, self.rating_matrix, compressed=False)
+        
+        # Save the user and movie IDs in index order; the mappings are rebuilt from them
+        data_path = str(filepath) + "_data.npz"
+        np.savez(data_path, user_ids=self.user_index.to_numpy(), movie_ids=self.movie_index.to_numpy())
         
         print(f"Model saved to {filepath}")
         print(f"Files created:")
-        print(f"  - {trace_path}")
+        if self.trace is not None:
+            print(f"  - {trace_path}")
         print(f"  - {state_path}")
+        print(f"  - {matrix_path}")
         print(f"  - {data_path}")
     
     @classmethod
@@ -329,9 +529,14 @@ class HierarchicalBayesianRecommender:
         # Check if all required files exist
         trace_path = str(filepath) + "_trace.nc"
         state_path = str(filepath) + "_state.pkl"
-        data_path = str(filepath) + "_data.pkl"
-        
-        for path in [trace_path, state_path, data_path]:
+        matrix_path = str(filepath) + "_matrix.npz"
+        data_path = str(filepath) + "_data.npz"
+        legacy_data_path = str(filepath) + "_data.pkl"
+        
+        # Models saved before the ID arrays were stored pickle their DataFrames instead
+        legacy = not os.path.exists(data_path) and os.path.exists(legacy_data_path)
+        required = [state_path, legacy_data_path] if legacy else [state_path, matrix_path, data_path]
+        for path in required:
             if not os.path.exists(path):
                 raise FileNotFoundError(f"Required file not found: {path}")
         
@@ -349,37 +554,37 @@ class HierarchicalBayesianRecommender:
             sigma_beta=model_state['sigma_beta'],
             sigma=model_state['sigma'],
             mu_mean=model_state['mu_mean'],
-            mu_sigma=model_state['mu_sigma']
+            mu_sigma=model_state['mu_sigma'],
+            inference=model_state.get('inference', 'mcmc'),
+            n_iter=model_state.get('n_iter', 50000),
+            sampler=model_state.get('sampler', 'pymc'),
+            keep_trace=model_state.get('keep_trace', True)
         )
         
         model.model = pm.Model()
         
-        # Load trace
-        model.trace = az.from_netcdf(trace_path)
-        
-        # Load data
-        with open(data_path, 'rb') as f:
-            data_dict = pickle.load(f)
-        
-        model.ratings_df = data_dict['ratings_df']
-        model.movies_df = data_dict['movies_df']
-        
-        # Restore mappings and other attributes
-        model.user_map = model_state['user_map']
-        model.movie_map = model_state['movie_map']
-        model.user_reverse_map = model_state['user_reverse_map']
-        model.movie_reverse_map = model_state['movie_reverse_map']
-        model.num_users = model_state['num_users']
-        model.num_movies = model_state['num_movies']
+        # Load trace if one was saved
+        if os.path.exists(trace_path):
+            model.trace = az.from_netcdf(trace_path)
+        
+        if legacy:
+            with open(legacy_data_path, 'rb') as f:
+                data_dict = pickle.load(f)
+            model.movies_df = data_dict['movies_df']
+            if os.path.exists(matrix_path):
+                model._rating_matrix = sparse.load_npz(matrix_path).tocsr()
+            else:
+                model.ratings_df = data_dict['ratings_df']
+            user_ids = [model_state['user_reverse_map'][i] for i in range(model_state['num_users'])]
+            movie_ids = [model_state['movie_reverse_map'][i] for i in range(model_state['num_movies'])]
+            model._set_id_maps(user_ids, movie_ids)
+        else:
+            # Load rating matrix and restore mappings
+            model._rating_matrix = sparse.load_npz(matrix_path).tocsr()
+            with np.load(data_path) as data:
+                model._set_id_maps(data['user_ids'], data['movie_ids'])
         model._posterior_means = model_state['_posterior_means']
-        
-        # Recreate sparse rating matrix
-        model.rating_matrix = sparse.csr_matrix(
-            (model.ratings_df['rating'].values,
-             (model.ratings_df['uidx'].values, model.ratings_df['midx'].values)),
-            shape=(model.num_users, model.num_movies)
-        )
-        
+        model._cache_posterior_means()
         
         print(f"Model loaded from {filepath}")
         return model
@@ -401,6 +606,10 @@ class HierarchicalBayesianRecommender:
                 'target_accept': self.target_accept,
                 'draws': self.draws,
                 'tune': self.tune,
+                'inference': self.inference,
+                'n_iter': self.n_iter,
+                'sampler': self.sampler,
+                'keep_trace': self.keep_trace,
                 'sigma_alpha': self.sigma_alpha,
                 'sigma_beta': self.sigma_beta,
                 'sigma': self.sigma,
@@ -414,8 +623,8 @@ class HierarchicalBayesianRecommender:
                 'data_info': {
                     'num_users': self.num_users,
                     'num_movies': self.num_movies,
-                    'num_ratings': len(self.ratings_df),
-                    'sparsity': 1 - (len(self.ratings_df) / (self.num_users * self.num_movies))
+                    'num_ratings': self.rating_matrix.nnz,
+                    'sparsity': 1 - (self.rating_matrix.nnz / (self.num_users * self.num_movies))
                 },
                 'posterior_stats': {
                     'global_mean': float(self._posterior_means['mu']),
@@ -428,4 +637,4 @@ class HierarchicalBayesianRecommender:
     
     @property
     def is_fitted(self):
-        return self.model is not None and self.trace is not None
\ No newline at end of file
+        return self.model is not None and self._posterior_means is not None
\ No newline at end of file
@@ -44,14 +44,10 @@ def evaluate_model(method, n_neighbors=20, n_infer=1000):
 
     # Inference (predict for test set)
     test_sample = test_df.sample(n=min(n_infer, len(test_df)), random_state=42)
-    y_true = []
-    y_pred = []
+    y_true = test_sample['rating'].to_numpy()
     tracemalloc.start()
     start_time = time.time()
-    for _, row in test_sample.iterrows():
-        pred = model.predict(row['user_id'], row['item_id'])
-        y_true.append(row['rating'])
-        y_pred.append(pred)
+    y_pred = model.predict_batch(test_sample['user_id'].to_numpy(), test_sample['item_id'].to_numpy())
     infer_time = time.time() - start_time
     current, peak = tracemalloc.get_traced_memory()
     infer_mem_mb = peak / 1024 / 1024
@@ -1,7 +1,33 @@
 import numpy as np
 from scipy.sparse import csr_matrix
-from sklearn.metrics.pairwise import cosine_similarity
+from sklearn.preprocessing import normalize
 import pandas as pd
+try:
+    import numba
+except ImportError:
+    numba = None
+
+if numba is not None:
+    @numba.njit(parallel=True, fastmath=True, cache=True)
+    def _knn_predict_kernel(indptr, indices, data, major_idx, owner_idx, nbr_idx, nbr_sim, out):
+        """
+        Weighted neighbor average for every query b: the neighbors of owner_idx[b] are
+        looked up in row (CSR) or column (CSC) major_idx[b] of a matrix with sorted indices
+        """
+        for b in numba.prange(major_idx.shape[0]):
+            start = indptr[major_idx[b]]
+            end = indptr[major_idx[b] + 1]
+            owner = owner_idx[b]
+            numerator = 0.0
+            denominator = 0.0
+            for j in range(nbr_idx.shape[1]):
+                sim = nbr_sim[owner, j]
+                denominator += abs(sim)
+                target = nbr_idx[owner, j]
+                pos = start + np.searchsorted(indices[start:end], target)
+                if pos < end and indices[pos] == target:
+                    numerator += sim * data[pos]
+            out[b] = numerator / denominator if denominator > 0 else 0.0
 
 class KNNRecommender:
     def __init__(self, n_neighbors=5, method='user'):
@@ -14,7 +40,11 @@ class KNNRecommender:
         self.n_neighbors = n_neighbors
         self.method = method
         self.ratings_matrix = None
-        self.similarity_matrix = None
+        self._ratings_csc = None
+        self.user_index = None
+        self.item_index = None
+        self._nbr_idx = None
+        self._nbr_sim = None
         
     def fit(self, ratings):
         """
@@ -22,20 +52,32 @@ class KNNRecommender:
         Args:
             ratings: DataFrame containing user_id, item_id, rating
         """
-        # Create user-item rating matrix
-        self.ratings_matrix = pd.pivot_table(
-            ratings, 
-            values='rating',
-            index='user_id',
-            columns='item_id',
-            fill_value=0
+        # Average duplicate (user, item) ratings as the dense pivot table did; the sparse
+        # constructor would sum them instead
+        if ratings.duplicated(['user_id', 'item_id']).any():
+            ratings = ratings.groupby(['user_id', 'item_id'], as_index=False)['rating'].mean()
+        
+        # Create sparse user-item rating matrix
+        user_cat = pd.Categorical(ratings['user_id'])
+        item_cat = pd.Categorical(ratings['item_id'])
+        self.user_index = user_cat.categories
+        self.item_index = item_cat.categories
+        self.ratings_matrix = csr_matrix(
+            (ratings['rating'].to_numpy(np.float32), (user_cat.codes, item_cat.codes)),
+            shape=(len(self.user_index), len(self.item_index))
         )
+        self.ratings_matrix.sort_indices()
+        # Column-major copy for reading one item's ratings in user-based prediction
+        self._ratings_csc = self.ratings_matrix.tocsc() if self.method == 'user' else None
         
-        # Calculate similarity matrix
+        # Precompute top-K cosine neighbors once instead of sorting on every prediction.
+        # Rows are L2-normalized in place: the user matrix is copied once so the ratings
+        # are kept, the transposed item matrix is already a fresh copy
         if self.method == 'user':
-            self.similarity_matrix = cosine_similarity(self.ratings_matrix)
-        else:  # item-based
-            self.similarity_matrix = cosine_similarity(self.ratings_matrix.T)
+            mat = self.ratings_matrix.copy()
+        else:
+            mat = self.ratings_matrix.T.tocsr()
+        self._top_k_neighbors(normalize(mat, axis=1, copy=False))
             
     def predict(self, user_id, item_id):
         """
@@ -51,66 +93,140 @@ class KNNRecommender:
         else:
             return self._predict_item_based(user_id, item_id)
     
+    def predict_batch(self, user_ids, item_ids):
+        """
+        Predict ratings for many user-item pairs at once
+        Args:
+            user_ids: Array-like of user IDs
+            item_ids: Array-like of item IDs, aligned with user_ids
+        Returns:
+            Array of predicted ratings (0 for unknown users or items)
+        """
+        user_idx = self.user_index.get_indexer(np.asarray(user_ids))
+        item_idx = self.item_index.get_indexer(np.asarray(item_ids))
+        predictions = np.zeros(len(user_idx), dtype=np.float64)
+        known = (user_idx >= 0) & (item_idx >= 0)
+        user_idx, item_idx = user_idx[known], item_idx[known]
+        if len(user_idx) == 0 or self._nbr_idx.shape[1] == 0:
+            return predictions
+        
+        if numba is not None:
+            # Stream each query's neighbors through the compiled kernel
+            if self.method == 'user':
+                mat, major, owner = self._ratings_csc, item_idx, user_idx
+            else:  # item-based
+                mat, major, owner = self.ratings_matrix, user_idx, item_idx
+            out = np.empty(len(user_idx), dtype=np.float64)
+            _knn_predict_kernel(mat.indptr, mat.indices, mat.data, major, owner,
+                                self._nbr_idx, self._nbr_sim, out)
+            predictions[known] = out
+            return predictions
+        
+        k = self._nbr_idx.shape[1]
+        if self.method == 'user':
+            sims = self._nbr_sim[user_idx]
+            rows = self._nbr_idx[user_idx].ravel()
+            cols = np.repeat(item_idx, k)
+        else:  # item-based
+            sims = self._nbr_sim[item_idx]
+            rows = np.repeat(user_idx, k)
+            cols = self._nbr_idx[item_idx].ravel()
+        ratings = np.asarray(self.ratings_matrix[rows, cols]).reshape(-1, k)
+        
+        # Weighted average rating over the K neighbors of every pair
+        numerator = (sims * ratings).sum(axis=1)
+        denominator = np.abs(sims).sum(axis=1)
+        predictions[known] = np.divide(
+            numerator, denominator, out=np.zeros_like(numerator, dtype=np.float64), where=denominator != 0
+        )
+        return predictions
+    
+    def _top_k_neighbors(self, X, block_size=512):
+        """
+        Find the K most cosine-similar rows of every row of X, one block of rows at a time
+        Args:
+            X: L2-normalized sparse matrix whose rows are the users (or items) to compare
+            block_size: Number of rows whose similarities are held densely at a time
+        """
+        n = X.shape[0]
+        k = min(self.n_neighbors, n - 1)
+        self._nbr_idx = np.zeros((n, max(k, 0)), dtype=np.int32)
+        self._nbr_sim = np.zeros((n, max(k, 0)), dtype=np.float32)
+        if k <= 0:
+            return
+        
+        X = X.astype(np.float32, copy=False)
+        XT = X.T.tocsc()
+        for start in range(0, n, block_size):
+            # Cosine similarity of this block against all rows
+            block = (X[start:start + block_size] @ XT).toarray()
+            rows = np.arange(block.shape[0])
+            # Exclude each row's self-similarity
+            block[rows, start + rows] = -np.inf
+            top = np.argpartition(-block, k - 1, axis=1)[:, :k]
+            top_sim = np.take_along_axis(block, top, axis=1)
+            order = np.argsort(-top_sim, axis=1)
+            self._nbr_idx[start:start + len(block)] = np.take_along_axis(top, order, axis=1)
+            self._nbr_sim[start:start + len(block)] = np.take_along_axis(top_sim, order, axis=1)
+    
+    @staticmethod
+    def _lookup(mat, major_idx, minor_idx):
+        """
+        Read entries of one row (CSR) or column (CSC) of a sparse matrix
+        Args:
+            mat: CSR or CSC matrix with sorted indices
+            major_idx: Row (CSR) or column (CSC) to read
+            minor_idx: Array of positions within that row/column
+        Returns:
+            Array of entries, 0 where not stored
+        """
+        start, end = mat.indptr[major_idx], mat.indptr[major_idx + 1]
+        indices = mat.indices[start:end]
+        if len(indices) == 0:
+            return np.zeros(len(minor_idx), dtype=mat.dtype)
+        pos = np.minimum(np.searchsorted(indices, minor_idx), len(indices) - 1)
+        return np.where(indices[pos] == minor_idx, mat.data[start:end][pos], 0)
+    
     def _predict_user_based(self, user_id, item_id):
         """User-based collaborative filtering prediction"""
-        if user_id not in self.ratings_matrix.index or item_id not in self.ratings_matrix.columns:
+        if user_id not in self.user_index or item_id not in self.item_index:
             return 0
             
-        # Get user index
-        user_idx = self.ratings_matrix.index.get_loc(user_id)
-        
-        # Get K most similar users
-        similar_users = np.argsort(self.similarity_matrix[user_idx])[-self.n_neighbors-1:-1][::-1]
+        # Get user and item indices
+        user_idx = self.user_index.get_loc(user_id)
+        item_idx = self.item_index.get_loc(item_id)
         
-        # Calculate weighted average rating
-        numerator = 0
-        denominator = 0
+        # Calculate weighted average rating over the K most similar users
+        sims = self._nbr_sim[user_idx]
+        ratings = self._lookup(self._ratings_csc, item_idx, self._nbr_idx[user_idx])
+        denominator = np.abs(sims).sum()
         
-        for similar_user_idx in similar_users:
-            similarity = self.similarity_matrix[user_idx, similar_user_idx]
-            rating = self.ratings_matrix.iloc[similar_user_idx][item_id]
-            
-            numerator += similarity * rating
-            denominator += abs(similarity)
-            
         if denominator == 0:
             return 0
             
-        return numerator / denominator
+        return (sims * ratings).sum() / denominator
     
     def _predict_item_based(self, user_id, item_id):
         """Item-based collaborative filtering prediction"""
-        if user_id not in self.ratings_matrix.index or item_id not in self.ratings_matrix.columns:
+        if user_id not in self.user_index or item_id not in self.item_index:
             return 0
             
-        # Get item index
-        item_idx = self.ratings_matrix.columns.get_loc(item_id)
-        
-        # Get user's rated items
-        user_ratings = self.ratings_matrix.loc[user_id]
-        rated_items = user_ratings[user_ratings > 0].index
+        # Get user and item indices
+        user_idx = self.user_index.get_loc(user_id)
+        item_idx = self.item_index.get_loc(item_id)
         
-        if len(rated_items) == 0:
+        if self.ratings_matrix.indptr[user_idx] == self.ratings_matrix.indptr[user_idx + 1]:
             return 0
             
-        # Get K most similar items
-        similar_items = np.argsort(self.similarity_matrix[item_idx])[-self.n_neighbors-1:-1][::-1]
+        # Calculate weighted average rating over the K most similar items
+        sims = self._nbr_sim[item_idx]
+        ratings = self._lookup(self.ratings_matrix, user_idx, self._nbr_idx[item_idx])
+        denominator = np.abs(sims).sum()
         
-        # Calculate weighted average rating
-        numerator = 0
-        denominator = 0
-        
-        for similar_item_idx in similar_items:
-            similarity = self.similarity_matrix[item_idx, similar_item_idx]
-            rating = user_ratings.iloc[similar_item_idx]
-            
-            numerator += similarity * rating
-            denominator += abs(similarity)
-            
         if denominator == 0:
             return 0
             
-        return numerator / denominator
+        return (sims * ratings).sum() / denominator
     
     def recommend(self, user_id, n_recommendations=5):
         """
@@ -121,19 +237,23 @@ class KNNRecommender:
         Returns:
             List of (item_id, predicted_rating) tuples
         """
-        if user_id not in self.ratings_matrix.index:
+        if user_id not in self.user_index:
             return []
             
-        # Get user's unrated items
-        user_ratings = self.ratings_matrix.loc[user_id]
-        unrated_items = user_ratings[user_ratings == 0].index
+        # Get user's unrated items from a mask over the item index space
+        user_idx = self.user_index.get_loc(user_id)
+        start, end = self.ratings_matrix.indptr[user_idx], self.ratings_matrix.indptr[user_idx + 1]
+        rated = np.zeros(len(self.item_index), dtype=bool)
+        rated[self.ratings_matrix.indices[start:end]] = True
+        unrated_items = self.item_index[~rated]
         
-        # Predict ratings for unrated items
-        predictions = []
-        for item_id in unrated_items:
-            pred_rating = self.predict(user_id, item_id)
-            predictions.append((item_id, pred_rating))
-            
-        # Sort by predicted rating and return top-N
-        predictions.sort(key=lambda x: x[1], reverse=True)
-        return predictions[:n_recommendations] 
\ No newline at end of file
+        # Predict ratings for all unrated items at once
+        predictions = self.predict_batch(np.full(len(unrated_items), user_id), unrated_items)
+        
+        # Select and sort top-N
+        n = min(n_recommendations, len(unrated_items))
+        if n <= 0:
+            return []
+        top = np.argpartition(-predictions, n - 1)[:n]
+        top = top[np.argsort(-predictions[top], kind='stable')]
+        return list(zip(unrated_items[top], predictions[top]))
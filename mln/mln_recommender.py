@@ -4,15 +4,20 @@ from collections import defaultdict
 from PAMI.frequentPattern.basic import FPGrowth as alg
 from problog.program import PrologString
 from problog import get_evaluatable
+from problog.engine import DefaultEngine
 from problog.logic import Term, Constant, Var
 from sklearn.model_selection import train_test_split
 from tqdm import tqdm
 import re
 import matplotlib.pyplot as plt
-from scipy.stats import norm
+from scipy.special import ndtri
 import os
 import sys
 import multiprocessing as mp
+from multiprocessing import shared_memory
+import math
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from scipy import sparse
 from functools import partial
 
 def parse_result(result):
@@ -25,31 +30,65 @@ def parse_result(result):
     Returns:
         DataFrame: Parsed results with userId, movieId, probability
     """
-    parsed = pd.DataFrame(columns=['userId', 'movieId', 'probability'])
+    rows = []
     for key, value in result.items():
         if isinstance(key, Term):
-            user = str(key.args[0])
-            movie = str(key.args[1])
-            parsed.loc[len(parsed)] = {
-                'userId': int(user[4:]),  # Extract userId from Term
-                'movieId': int(movie[5:]),  # Extract movieId from Term
-                'probability': value
-            }
-    return parsed
+            # Arguments are the atoms userN and movieM, read from their functor names
+            rows.append((
+                int(key.args[0].functor[4:]),
+                int(key.args[1].functor[5:]),
+                value
+            ))
+    return pd.DataFrame(rows, columns=['userId', 'movieId', 'probability'])
 
-def process_batch(batch_world_str):
+# World program prepared (parsed into a clause database) once per worker process
+_world = None
+
+def _prepare_world(world_str):
+    """
+    Parse the world program into a ProbLog clause database.
+    
+    Args:
+        world_str (str): ProbLog world program
+        
+    Returns:
+        tuple: Engine and its prepared clause database
+    """
+    engine = DefaultEngine()
+    return engine, engine.prepare(PrologString(world_str))
+
+def _worker_init(shm_name, size):
+    """
+    Pool initializer: parse the world program into a ProbLog clause database once per worker.
+    
+    Args:
+        shm_name (str): Name of the shared memory block holding the UTF-8 world program
+        size (int): Length of the encoded program in bytes
+    """
+    global _world
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        world_str = bytes(shm.buf[:size]).decode()
+    finally:
+        shm.close()
+    _world = _prepare_world(world_str)
+
+def process_batch(batch, world=None):
         """
         Process a batch of queries in parallel.
         
         Args:
-            batch_world_str (tuple): Tuple containing batch of queries and world string
+            batch (list): Batch of query strings
+            world (tuple): Prepared world from _prepare_world, defaults to the worker's world
         """
-        batch, world_str = batch_world_str
         query_str = "\n".join(batch)
         try:
+            # Ground only this batch's queries against the shared world database
+            engine, db = world if world is not None else _world
+            queries = [clause.args[0] for clause in PrologString(query_str)]
             result = parse_result(
                 get_evaluatable().create_from(
-                    PrologString(world_str + query_str)
+                    engine.ground_all(db, queries=queries)
                 ).evaluate()
             )
             return result
@@ -91,13 +130,36 @@ class MarkovLogicNetworkwithUserGenreModel:
         
         # Model components
         self.user_preferences = None
+        self.genre_masks = None
+        self.preference_masks = None
+        self.likes_weights = None
         self.frequent_patterns = None
         self.pattern_dict = {}
         self.transactions = None
         self.movie_stats = None
         self.overall_mean = None
         self.overall_std = None
+        self.world_str = None
+        self.preference_str = None
         
+    def _genre_masks(self, movies):
+        """
+        Encode each movie's genre list as a bitmask.
+
+        Args:
+            movies (DataFrame): Movie data with genres
+
+        Returns:
+            ndarray: uint32 mask per movie, bit i set when the movie has genre self.genres[i]
+        """
+        genre_lists = movies['genres']
+        movie_pos = np.repeat(np.arange(len(movies)), genre_lists.str.len().to_numpy())
+        genre_pos = pd.Index(self.genres).get_indexer(genre_lists.explode().to_numpy())
+        known = genre_pos >= 0
+        masks = np.zeros(len(movies), dtype=np.uint32)
+        np.bitwise_or.at(masks, movie_pos[known], np.left_shift(np.uint32(1), genre_pos[known].astype(np.uint32)))
+        return masks
+
     def extract_user_preferences(self, train_data, movies):
         """
         Extract user preferences from rating data.
@@ -109,43 +171,56 @@ class MarkovLogicNetworkwithUserGenreModel:
         # Filter ratings above threshold
         binary_ratings = train_data[train_data["rating"] >= self.preference_rating_threshold]
         
-        # Initialize user preferences matrix
-        self.user_preferences = pd.DataFrame(
-            index=binary_ratings['userId'].unique(), 
-            columns=self.genres, 
-            dtype=float
-        ).fillna(0)
-        
-        # Calculate preferences based on movie genres
-        for row in binary_ratings.itertuples():
-            if row.movieId in movies.index:
-                movie_genres = movies.loc[row.movieId, 'genres']
-                total_utility = len(movie_genres)
-                for genre in movie_genres:
-                    if genre in self.user_preferences.columns:
-                        self.user_preferences.at[row.userId, genre] += 1/total_utility
+        # Genre utility per movie: each of a movie's genres gets 1/number of genres
+        self.genre_masks = pd.Series(self._genre_masks(movies), index=movies.index)
+        bits = (self.genre_masks.to_numpy()[:, None] >> np.arange(len(self.genres), dtype=np.uint32)) & 1
+        n_genres_per_movie = bits.sum(axis=1, keepdims=True)
+        utility = np.divide(bits, n_genres_per_movie, out=np.zeros(bits.shape), where=n_genres_per_movie > 0)
+
+        # Preferences are liked @ utility, with liked the sparse user x movie indicator of
+        # ratings above threshold. Its indices are left in rating order within each row
+        # (not canonicalized), so the product sums each user's utilities sequentially
+        user_codes, user_ids = pd.factorize(binary_ratings['userId'])
+        movie_codes = movies.index.get_indexer(binary_ratings['movieId'])
+        rated = movie_codes >= 0
+        user_codes, movie_codes = user_codes[rated], movie_codes[rated]
+        order = np.argsort(user_codes, kind='stable')
+        indptr = np.r_[0, np.cumsum(np.bincount(user_codes, minlength=len(user_ids)))]
+        liked = sparse.csr_matrix(
+            (np.ones(len(order)), movie_codes[order], indptr),
+            shape=(len(user_ids), len(movies))
+        )
+        preferences = liked @ utility
+        self.user_preferences = pd.DataFrame(preferences, index=user_ids, columns=self.genres)
         
         # Normalize and binarize preferences
         normalized_user_preferences = self.user_preferences.div(
             self.user_preferences.sum(axis=1), axis=0
         )
         binary_user_preferences = normalized_user_preferences >= self.preference_threshold
+        self.preference_masks = pd.Series(
+            np.bitwise_or.reduce(
+                binary_user_preferences.to_numpy().astype(np.uint32) << np.arange(len(self.genres), dtype=np.uint32),
+                axis=1
+            ),
+            index=binary_user_preferences.index
+        )
         
         # Create transactions for frequent pattern mining
         self.transactions = defaultdict(list)
-        for userId in binary_user_preferences.index:
-            self.transactions[userId] = binary_user_preferences.columns[
-                binary_user_preferences.loc[userId]
-            ].tolist()
+        genre_names = np.array(self.genres, dtype=object)
+        for userId, row in zip(binary_user_preferences.index, binary_user_preferences.to_numpy()):
+            self.transactions[userId] = genre_names[row].tolist()
     
     def mine_frequent_patterns(self):
         """
         Mine frequent patterns from user preferences using FP-Growth algorithm.
         """
-        # Convert transactions to DataFrame format for PAMI
-        transactions_df = pd.DataFrame(columns=["Transactions"])
-        for userId, items in self.transactions.items():
-            transactions_df.loc[userId, 'Transactions'] = ",".join(list(set(items)))
+        # Convert transactions to DataFrame format for PAMI, which only reads separator-joined strings
+        transactions_df = pd.DataFrame(
+            {'Transactions': [",".join(sorted(set(items))) for items in self.transactions.values()]},
+            index=list(self.transactions.keys())
+        )
         
         # Run FP-Growth algorithm
         obj = alg.FPGrowth(iFile=transactions_df, minSup=self.min_support, sep=',')
@@ -153,15 +228,12 @@ class MarkovLogicNetworkwithUserGenreModel:
         
         # Get frequent patterns
         self.frequent_patterns = obj.getPatternsAsDataFrame()
-        self.frequent_patterns['Patterns'] = self.frequent_patterns['Patterns'].apply(
-            lambda x: ' '.join(sorted(x.split()))
-        )
+        # Depending on the PAMI version, items are separated by whitespace or by sep
+        items = [tuple(sorted(re.split(r'[\s,]+', x.strip()))) for x in self.frequent_patterns['Patterns']]
+        self.frequent_patterns['Patterns'] = [' '.join(pattern) for pattern in items]
         
-        # Create pattern dictionary for rule generation
-        self.pattern_dict = {
-            row['Patterns']: row['Support'] 
-            for index, row in self.frequent_patterns.iterrows()
-        }
+        # Create pattern dictionary for rule generation, keyed by sorted item tuples
+        self.pattern_dict = dict(zip(items, self.frequent_patterns['Support'].tolist()))
     
     def generate_logic_rules(self, movies, output_dir='mln'):
         """
@@ -169,58 +241,93 @@ class MarkovLogicNetworkwithUserGenreModel:
         
         Args:
             movies (DataFrame): Movie data with movieId and genres
-            output_dir (str): Directory to save the generated files
+            output_dir (str): Directory to save the generated files. None keeps them in memory only
+            
+        Returns:
+            tuple: World and preference programs as strings
         """
-        # Create output directory if it doesn't exist
-        os.makedirs(output_dir, exist_ok=True)
-        
         # Generate world rules
-        with open(f'{output_dir}/world.pl', 'w') as f:
-            base_prob = 0.9
-            # Rules for movies with different number of genres
-            for i in range(1, 6):
-                f.write(f'{base_prob/i}::likes(U, M):- prefers(U, G), has_genre(M, G), has_{i}_genre(M).\n')
-            f.write(f'{base_prob/6.0}::likes(U, M):- prefers(U, G), has_genre(M, G), has_more_than_5_genre(M).\n')
-            
-            # User preferences facts
-            for userId, items in self.transactions.items():
-                for item in items:
-                    f.write(f'prefers(user{userId}, {item.lower()}).\n')
-            
-            # Movie genre facts
-            movies.index = movies['movieId']
-            for movieId, row in movies.iterrows():
-                if len(row['genres']) <= 5:
-                    f.write(f'has_{len(row["genres"])}_genre(movie{movieId}).\n')
-                else:
-                    f.write(f'has_more_than_5_genre(movie{movieId}).\n')
-                    
-                for genre in row['genres']:
-                    if genre == '(no genres listed)':
-                        continue
-                    f.write(f'has_genre(movie{movieId}, {genre.lower()}).\n')
-        
-        # Generate preference rules from frequent patterns
-        with open(f'{output_dir}/preference.pl', 'w') as f:
-            # rules 定義
-            for row in self.frequent_patterns.itertuples(index=True):
-                items = row.Patterns.split()
-                if len(items) < 2:
-                    continue
-        for i in range(len(items)):
-            body = ' '.join(sorted(items[:i]+items[i+1:]))
-            if body not in self.pattern_dict:
-                continue
-            print(body)
-            total_support = self.pattern_dict[body]
-            head = items[i]
-            sub_total_support = row.Support
-            f.write(f'{sub_total_support/total_support:.2f}::prefers(u, {head.lower()}) :-')
-            for item in body.split():
-                f.write(f'prefers(u, {item.lower()})')
-                if item != body.split()[-1]:
-                    f.write(', ')
-            f.write(f'.\n')
+        base_prob = 0.9
+        # Rules for movies with different number of genres
+        lines = [
+            f'{base_prob/i}::likes(U, M):- prefers(U, G), has_genre(M, G), has_{i}_genre(M).'
+            for i in range(1, 6)
+        ]
+        lines.append(f'{base_prob/6.0}::likes(U, M):- prefers(U, G), has_genre(M, G), has_more_than_5_genre(M).')
+        
+        # User preferences facts
+        lines.extend(
+            f'prefers(user{userId}, {item.lower()}).'
+            for userId, items in self.transactions.items() for item in items
+        )
+        
+        # Movie genre facts: each movie's arity fact followed by its genre facts
+        movie_ids = movies['movieId'].astype(str).to_numpy(dtype=object)
+        n_genres = movies['genres'].str.len().to_numpy()
+        # Weight of the likes/2 rule selected by each movie's arity fact
+        arity = np.where(n_genres <= 5, n_genres, 6.0)
+        self.likes_weights = pd.Series(
+            np.divide(base_prob, arity, out=np.zeros(len(arity)), where=arity > 0),
+            index=movies['movieId'].to_numpy()
+        )
+        arity_facts = np.where(
+            n_genres <= 5,
+            'has_' + n_genres.astype(str).astype(object) + '_genre(movie' + movie_ids + ').',
+            'has_more_than_5_genre(movie' + movie_ids + ').'
+        )
+        exploded = pd.DataFrame({'pos': np.arange(len(movies)), 'movieId': movie_ids, 'genre': movies['genres'].to_numpy()}).explode('genre')
+        exploded = exploded[exploded['genre'] != '(no genres listed)']
+        genre_facts = 'has_genre(movie' + exploded['movieId'] + ', ' + exploded['genre'].str.lower() + ').'
+        movie_facts = pd.concat([
+            pd.Series(arity_facts, index=np.arange(len(movies))),
+            pd.Series(genre_facts.to_numpy(), index=exploded['pos'].to_numpy())
+        ]).sort_index(kind='stable')
+        lines.extend(movie_facts.tolist())
+        world_str = '\n'.join(lines) + '\n'
+        
+        # Generate preference rules from frequent patterns, encoded as genre bitmasks whose
+        # bits follow the sorted genre names, so set bits enumerate a pattern's sorted items
+        genre_names = sorted(self.genres)
+        genre_bit = {genre: 1 << i for i, genre in enumerate(genre_names)}
+        masks = np.array(
+            [sum(genre_bit[item] for item in pattern) for pattern in self.pattern_dict], dtype=np.int64
+        )
+        supports = np.array(list(self.pattern_dict.values()), dtype=float)
+        support_by_mask = pd.Series(supports, index=masks)
+
+        # One rule per item of every multi-item pattern, with the rest of the pattern as the body
+        bits = np.arange(len(genre_names))
+        in_pattern = (masks[:, None] >> bits) & 1 == 1
+        in_pattern &= in_pattern.sum(axis=1, keepdims=True) >= 2
+        pattern_pos, head_pos = np.nonzero(in_pattern)
+        body_masks = masks[pattern_pos] & ~(1 << head_pos)
+        total_support = support_by_mask.reindex(body_masks).to_numpy()
+        found = ~np.isnan(total_support)
+        pattern_pos, head_pos, body_masks = pattern_pos[found], head_pos[found], body_masks[found]
+        ratios = supports[pattern_pos] / total_support[found]
+
+        # Format each distinct body once
+        conditions = {
+            body: ', '.join(f'prefers(u, {genre_names[i].lower()})' for i in bits if body >> i & 1)
+            for body in np.unique(body_masks).tolist()
+        }
+        heads = [genre.lower() for genre in genre_names]
+        lines = [
+            f'{ratio:.2f}::prefers(u, {heads[head]}) :-{conditions[body]}.'
+            for ratio, head, body in zip(ratios.tolist(), head_pos.tolist(), body_masks.tolist())
+        ]
+
+        preference_str = ''.join(line + '\n' for line in lines)
+        
+        # Keep the programs for predict, write them only when asked to
+        self.world_str, self.preference_str = world_str, preference_str
+        if output_dir is not None:
+            os.makedirs(output_dir, exist_ok=True)
+            with open(f'{output_dir}/world.pl', 'w') as f:
+                f.write(world_str)
+            with open(f'{output_dir}/preference.pl', 'w') as f:
+                f.write(preference_str)
+        return world_str, preference_str
     
     def calculate_movie_stats(self, data):
         """
@@ -235,90 +342,147 @@ class MarkovLogicNetworkwithUserGenreModel:
         self.movie_stats = data.groupby('movieId')['rating'].agg(['mean', 'std', 'count'])
         
         # Handle movies with few ratings
-        self.movie_stats['mean'] = self.movie_stats.apply(
-            lambda row: self.overall_mean if row['count'] < 10 else row['mean'], axis=1
-        )
-        self.movie_stats['std'] = self.movie_stats.apply(
-            lambda row: self.overall_std if row['count'] < 10 else row['std'], axis=1
-        )
+        low = self.movie_stats['count'] < 10
+        self.movie_stats['mean'] = self.movie_stats['mean'].mask(low, self.overall_mean)
+        self.movie_stats['std'] = self.movie_stats['std'].mask(low, self.overall_std)
     
     def infer_rating(self, movie_id, prob_likes):
         """
         Convert probability of liking to rating using normal distribution.
         
         Args:
-            mu (float): Mean rating for the movie
-            sigma (float): Standard deviation of rating for the movie
+            movie_id (int): Movie ID
             prob_likes (float): Probability of liking the movie
             
         Returns:
             float: Inferred rating
         """
-        if movie_id in self.movie_stats.index:
-            mu = self.movie_stats.loc[movie_id, 'mean']
-            sigma = self.movie_stats.loc[movie_id, 'std']
-        else:
-            mu = self.overall_mean
-            sigma = self.overall_std
-        p = np.clip(prob_likes, 0.0, 1.0)
-        score = np.clip(norm(mu, sigma).ppf(p), 0.5, 5.0)
-        return score
+        return self.infer_ratings(np.array([movie_id]), np.array([prob_likes]))[0]
     
-    def predict(self, test_data, output_dir='mln', batch_size=1000, n_jobs=-1):
+    def infer_ratings(self, movie_ids, prob_likes):
+        """
+        Vectorized infer_rating over arrays of movies and probabilities.
+        
+        Args:
+            movie_ids (array-like): Movie IDs
+            prob_likes (array-like): Probability of liking each movie
+            
+        Returns:
+            ndarray: Inferred ratings
+        """
+        # Movies without statistics fall back to the overall distribution
+        stats = self.movie_stats.reindex(movie_ids)
+        mu = stats['mean'].fillna(self.overall_mean).to_numpy(dtype=float)
+        sigma = stats['std'].fillna(self.overall_std).to_numpy(dtype=float)
+        p = np.clip(np.asarray(prob_likes, dtype=float), 0.0, 1.0)
+        # Normal quantile via location-scale on the standard normal inverse CDF, whose C kernel
+        # skips the argument handling of norm.ppf. A zero sigma is a point mass at mu, also at
+        # p = 0 or 1 where 0 * inf would give NaN
+        with np.errstate(invalid='ignore'):
+            ratings = np.where(sigma == 0, mu, mu + sigma * ndtri(p))
+        return np.clip(ratings, 0.5, 5.0)
+    
+    def likes_probabilities(self, user_ids, movie_ids):
+        """
+        Evaluate P(likes(user, movie)) of the world program in closed form.
+        
+        A user and a movie sharing k genres ground the movie's likes/2 rule k times, each
+        grounding an independent choice with the rule's weight w, so P = 1 - (1 - w)^k.
+        The preference rules are stated for the constant u and derive no prefers/2 facts
+        for actual users.
+        
+        Args:
+            user_ids (array-like): User IDs
+            movie_ids (array-like): Movie IDs, aligned with user_ids
+            
+        Returns:
+            ndarray: Probability that each user likes the movie
+        """
+        user_masks = self.preference_masks.reindex(user_ids, fill_value=0).to_numpy(dtype=np.uint32)
+        movie_masks = self.genre_masks.reindex(movie_ids, fill_value=0).to_numpy(dtype=np.uint32)
+        shared = ((user_masks & movie_masks)[:, None] >> np.arange(len(self.genres), dtype=np.uint32)) & 1
+        weights = self.likes_weights.reindex(movie_ids, fill_value=0.0).to_numpy(dtype=float)
+        return 1.0 - (1.0 - weights) ** shared.sum(axis=1)
+    
+    def predict(self, test_data, output_dir=None, batch_size=100, n_jobs=-1):
         """
         Make predictions for test data.
         
         Args:
             test_data (DataFrame): Test data with userId, movieId, rating
-            output_dir (str): Directory containing the generated rules
-            batch_size (int): Batch size for inference
+            output_dir (str): Directory that receives the evaluated program (likes.pl) and
+                query.pl. None keeps them in memory only
+            batch_size (int): Maximum number of queries per inference batch
             n_jobs (int): Number of parallel jobs. -1 means using all processors
         Returns:
             DataFrame: Predictions with userId, movieId, probability, rating
         """
-        # Generate queries
-        with open(f'{output_dir}/query.pl', 'w') as f:
-            for row in test_data.itertuples():
-                f.write(f'query(likes(user{row.userId}, movie{row.movieId})).\n')
-        
-        # Load rules
-        world_str = (open(f'{output_dir}/world.pl').read() + 
-                    open(f'{output_dir}/preference.pl').read())
-        queries = open(f'{output_dir}/query.pl').read().splitlines()
-        
-        # Split queries into batches
-        batches = [queries[i:i + batch_size] for i in range(0, len(queries), batch_size)]
-        
-
+        # Generate one query per distinct pair
+        pairs = test_data[['userId', 'movieId']].drop_duplicates()
+        likes = (
+            'likes(user' + pairs['userId'].astype(str).to_numpy(dtype=object)
+            + ', movie' + pairs['movieId'].astype(str).to_numpy(dtype=object) + ')'
+        )
+        queries = 'query(' + likes + ').'
+        
+        # Precompute the likes/2 closure: each query becomes one independent probabilistic
+        # fact, so ProbLog no longer joins prefers/2 with has_genre/2 for every query
+        probabilities = self.likes_probabilities(pairs['userId'].to_numpy(), pairs['movieId'].to_numpy())
+        has_proof = probabilities > 0
+        facts = probabilities[has_proof].astype(str).astype(object) + '::' + likes[has_proof] + '.'
+        world_str = ''.join(fact + '\n' for fact in facts.tolist())
+        if output_dir is not None:
+            with open(f'{output_dir}/likes.pl', 'w') as f:
+                f.write(world_str)
+            with open(f'{output_dir}/query.pl', 'w') as f:
+                f.write(''.join(query + '\n' for query in queries.tolist()))
+        
+        # Pairs without a proof have probability 0 and are not sent to ProbLog
+        results = [pairs.loc[~has_proof].assign(probability=0.0)]
+        queries = queries[has_proof].tolist()
         
-        # Initialize multiprocessing pool
         n_jobs = mp.cpu_count() if n_jobs == -1 else n_jobs
-        pool = mp.Pool(processes=n_jobs)
-        
-        # Process batches in parallel
-        prediction = pd.DataFrame(columns=['userId', 'movieId', 'probability'])
-        with tqdm(total=len(queries)) as pbar:
-            pbar.set_description("Evaluating queries")
-            results = []
-            # Create iterable where each item is (batch, world_str)
-            batch_args = [(batch, world_str) for batch in batches]
-            for result in pool.imap_unordered(process_batch, batch_args):
-                results.append(result)
-                pbar.update(batch_size)
-        
-        pool.close()
-        pool.join()
+        # Too little work to amortize starting worker processes: evaluate in-process
+        sequential = n_jobs == 1 or len(queries) < 4 * batch_size
+        if not sequential:
+            # Evaluation cost grows quadratically with batch length, so batch_size is only
+            # an upper limit, lowered when needed to give every worker a batch
+            batch_size = min(batch_size, math.ceil(len(queries) / n_jobs))
+        batches = [queries[start:start + batch_size] for start in range(0, len(queries), batch_size)]
+        
+        if batches and sequential:
+            world = _prepare_world(world_str)
+            results += [
+                process_batch(batch, world)
+                for batch in tqdm(batches, desc="Evaluating queries", unit="batch")
+            ]
+        elif batches:
+            # Workers read the world program from one shared memory block instead of each
+            # receiving a pickled copy, and parse it once, not per batch
+            world_bytes = world_str.encode()
+            shm = shared_memory.SharedMemory(create=True, size=max(len(world_bytes), 1))
+            try:
+                shm.buf[:len(world_bytes)] = world_bytes
+                with ProcessPoolExecutor(max_workers=n_jobs, initializer=_worker_init,
+                                         initargs=(shm.name, len(world_bytes))) as executor:
+                    futures = [executor.submit(process_batch, batch) for batch in batches]
+                    results += [
+                        future.result()
+                        for future in tqdm(as_completed(futures), total=len(futures),
+                                           desc="Evaluating queries", unit="batch")
+                    ]
+            finally:
+                shm.close()
+                shm.unlink()
         
         # Combine results
         prediction = pd.concat(results, ignore_index=True)
         
         # Convert probabilities to ratings
         if not prediction.empty:
-            prediction['rating'] = prediction.apply(
-                lambda x: self.infer_rating(
-                    x.movieId,
-                    x.probability
-                ), axis=1
+            prediction['rating'] = self.infer_ratings(
+                prediction['movieId'].to_numpy(),
+                prediction['probability'].to_numpy()
             )
             
         # Merge predictions with test data while preserving order
@@ -338,7 +502,7 @@ class MarkovLogicNetworkwithUserGenreModel:
         Args:
             train_data (DataFrame): Training data
             movies (DataFrame): Movie data
-            output_dir (str): Output directory for intermediate files
+            output_dir (str): Output directory for intermediate files. None keeps them in memory only
             
         Returns:
             DataFrame: Predictions